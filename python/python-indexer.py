@@ -12,104 +12,453 @@ import json
 from pathlib import Path
 from collections import deque
 from dataclasses import dataclass
-from typing import Deque, Dict, Any, List, Optional
+from typing import Deque, Dict, Any, Iterator, List, Optional, Set, Tuple, Union
 import hashlib
+import mmap
+import os
+import stat
 import argparse
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import Executor, Future, FIRST_COMPLETED, wait
 from concurrent.futures import ThreadPoolExecutor, as_completed #for variant A
 from concurrent.futures import ProcessPoolExecutor #for variant B 
+from concurrent.futures.process import BrokenProcessPool
 
-def hash_file(path: Path, algo: str = "sha256") -> str:
-    h = hashlib.new(algo)
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
+# orjson is optional: a much faster encoder, but the stdlib json module works too
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# optional non-cryptographic hashes, selected with --hash blake3 / --hash xxh3_128
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# hash names provided by the optional packages above, mapped to their pip package
+EXTRA_HASHES = {"blake3": "blake3", "xxh3_128": "xxhash"}
+
+# size at which buffered JSONL records are written out
+WRITE_BUFFER_SIZE = 1 << 20
+
+# most records handed to a single writev() call (IOV_MAX on Linux)
+WRITEV_MAX_BUFFERS = 1024
+
+# key layout of a successfully hashed file, the shape of almost every record
+HASHED_RECORD_KEYS = ("filename", "path", "hash_algo", "size", "mtime", "owner", "hash", "variant")
+
+# upper bound on paths sent to a worker process per task (multiprocessing variant)
+MAX_CHUNKSIZE = 256
+
+# files up to this size are hashed from a single read(); larger ones are streamed
+READ_HASH_SIZE = 256 * 1024
+
+# files at least this large are hashed through mmap rather than read() copies
+# hazard: if a mapped file is truncated while being hashed, touching the missing pages
+# raises SIGBUS and kills the process (a worker in the multiprocessing variant, the
+# indexer itself otherwise); read() would simply hash fewer bytes
+MMAP_HASH_SIZE = 1 << 20
+
+# files modified within this many seconds (e.g. logs still being written or rotated)
+# are read rather than mapped, to keep clear of the SIGBUS hazard above
+MMAP_MIN_AGE = 60
+
+# one freshly initialised hash object per algorithm, filled lazily in each process
+HASH_PROTOTYPES: Dict[str, Any] = {}
+
+# the hash is used for file identity, not security: usedforsecurity=False keeps
+# algorithms such as md5 usable on FIPS-restricted builds
+# copying a prototype is a plain state copy, cheaper than hashlib.new's lookup and init
+def new_hash(algo: str):
+    proto = HASH_PROTOTYPES.get(algo)
+    if proto is None:
+        if algo == "blake3":
+            proto = blake3.blake3()
+        elif algo == "xxh3_128":
+            proto = xxhash.xxh3_128()
+        else:
+            proto = hashlib.new(algo, usedforsecurity=False)
+        HASH_PROTOTYPES[algo] = proto
+    return proto.copy()
+
+# checks whether an algorithm name can be used, including the optional extras
+def hash_available(algo: str) -> bool:
+    if algo == "blake3":
+        return blake3 is not None
+    if algo == "xxh3_128":
+        return xxhash is not None
+    # hashlib.new also accepts OpenSSL name variants (e.g. SHA256), so just try it
+    try:
+        h = new_hash(algo)
+    except ValueError:
+        return False
+    # variable-length digests (shake_128/shake_256) need a length for hexdigest()
+    return h.digest_size > 0
+
+# st can be passed in when the caller already has it, saving an fstat()
+def hash_file(
+    path: Union[str, os.DirEntry],
+    algo: str = "sha256",
+    st: Optional[os.stat_result] = None
+) -> str:
+    with open(path, "rb", buffering=0) as f:
+        if st is None:
+            st = os.fstat(f.fileno())
+        size = st.st_size
+
+        # small files: one read() and one update(); file_digest would allocate and
+        # zero-fill a fresh 256 KiB buffer on every call, which dominates for tiny files
+        if size <= READ_HASH_SIZE:
+            h = new_hash(algo)
+            h.update(f.read())
+            return h.hexdigest()
+
+        # hashlib.file_digest (3.11+) streams the file through one buffer with readinto(),
+        # and each 256 KiB update() releases the GIL
+        recently_modified = time.time() - st.st_mtime < MMAP_MIN_AGE
+        if (size < MMAP_HASH_SIZE or recently_modified) and hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, lambda: new_hash(algo)).hexdigest()
+
+        if algo == "blake3":
+            # update_mmap hashes the mapped file in native code with SIMD, releasing the GIL
+            # inside a pool worker process the pool already fills the cores, so stay on one
+            # thread there instead of starting workers x ncpu hashing threads
+            if multiprocessing.parent_process() is None:
+                h = blake3.blake3(max_threads=blake3.blake3.AUTO)
+            else:
+                h = blake3.blake3()
+            h.update_mmap(os.fspath(path))
+            return h.hexdigest()
+
+        # large, settled files (and older Pythons): one update over a mapping of the file,
+        # so the hash reads the page cache directly instead of copying through read() buffers
+        h = new_hash(algo)
+        if size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                h.update(mm)
+        return h.hexdigest()
+
+# walks the tree with os.scandir, yielding a DirEntry per file
+# DirEntry.is_file()/is_dir() reuse the type returned by readdir, so unlike
+# rglob + Path.is_file() no extra stat() is needed per entry
+def iter_files(root: Path, walk_workers: int = 1) -> Iterator[os.DirEntry]:
+    if walk_workers > 1:
+        yield from iter_files_parallel(root, walk_workers)
+        return
+
+    stack = [os.fspath(root)]
+    while stack:
+        subdirs, files = list_dir(stack.pop())
+        stack.extend(subdirs)
+        yield from files
+
+# splits one directory listing into subdirectories and files
+# unreadable directories are skipped, as rglob did
+def list_dir(path: str) -> Tuple[List[str], List[os.DirEntry]]:
+    subdirs: List[str] = []
+    files: List[os.DirEntry] = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry)
+    except OSError:
+        pass
+    return subdirs, files
+
+# lists directories on a thread pool so that slow readdir calls (NFS, FUSE) overlap
+# each subdirectory is submitted as soon as its parent listing completes
+def iter_files_parallel(root: Path, walk_workers: int) -> Iterator[os.DirEntry]:
+    with ThreadPoolExecutor(max_workers=walk_workers) as pool:
+        pending = {pool.submit(list_dir, os.fspath(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, files = future.result()
+                pending.update(pool.submit(list_dir, d) for d in subdirs)
+                yield from files
 
 # scanning files for multiprocessing method
-def scan_one_path_mp(args):
-    path, hash_algo= args
-    record = scan_one_path(path, hash_algo)
-    return record
+# takes a chunk of paths per task, so one IPC round trip covers many files
+def scan_chunk_mp(args):
+    paths, hash_algo = args
+    return [scan_one_path(p, hash_algo) for p in paths]
+
+# groups a stream of paths into chunks for the process pool
+# the total is unknown while streaming, so chunks start at one path and double up to
+# max_size: small trees still spread across every worker, large trees amortise IPC
+def iter_chunks(items: Iterator[Any], max_size: int = MAX_CHUNKSIZE) -> Iterator[List[Any]]:
+    chunk: List[Any] = []
+    size = 1
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+            size = min(size * 2, max_size)
+    if chunk:
+        yield chunk
 
 # scanning files for thread-pool method
-def scan_one_path(path: Path, hash_algo: str) -> Dict[str, Any]:
+# accepts a DirEntry from the walker or a plain str path (multiprocessing)
+def scan_one_path(path: Union[str, os.DirEntry], hash_algo: str) -> Dict[str, Any]:
+    is_entry = isinstance(path, os.DirEntry)
     rec: Dict[str, Any] = {
-        "filename": path.name,
-        "path": str(path),
+        "filename": path.name if is_entry else os.path.basename(path),
+        "path": os.fspath(path),
         "hash_algo": hash_algo,
     }
 
     try:
-        st = path.stat()
+        # the only stat() per file: DirEntry caches it, and the file check reuses st_mode
+        st = path.stat() if is_entry else os.stat(path)
         rec["size"] = st.st_size
         rec["mtime"] = st.st_mtime
         rec["owner"] = getattr(st, "st_uid", None)
 
-        if path.is_file():
-            rec["hash"] = hash_file(path, hash_algo)
+        if stat.S_ISREG(st.st_mode):
+            rec["hash"] = hash_file(path, hash_algo, st)
 
     except Exception as e:
         rec["error"] = str(e)
 
     return rec
 
+# submits jobs while the walker is still yielding them, so traversal overlaps with hashing
+# at most max_in_flight jobs are queued at once, keeping memory flat on huge trees
+def submit_streaming(pool: Executor, fn, jobs, max_in_flight: int) -> Iterator[Any]:
+    in_flight: Set[Future] = set()
+    for job in jobs:
+        if len(in_flight) >= max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        in_flight.add(pool.submit(fn, job))
+
+    for future in as_completed(in_flight):
+        yield future.result()
+
+# quotes a string for JSON, skipping the encoder when nothing needs escaping
+def json_str(s: str) -> str:
+    if s.isascii() and s.isprintable() and '"' not in s and "\\" not in s:
+        return f'"{s}"'
+    return json.dumps(s)
+
+# formats a hashed-file record from a fixed template, skipping the generic encoder's
+# per-key type dispatch; about twice as fast as json.dumps, but slower than orjson
+def encode_hashed_record(record: Dict[str, Any]) -> bytes:
+    return (
+        f'{{"filename":{json_str(record["filename"])},'
+        f'"path":{json_str(record["path"])},'
+        f'"hash_algo":{json_str(record["hash_algo"])},'
+        f'"size":{record["size"]:d},'
+        f'"mtime":{record["mtime"]!r},'
+        f'"owner":{record["owner"]:d},'
+        f'"hash":"{record["hash"]}",'
+        f'"variant":"{record["variant"]}"}}\n'
+    ).encode("ascii")
+
+# encodes one record as a JSON line
+# orjson rejects lone surrogates (undecodable filenames), so those fall back to the
+# template (hashed files) or json (errors, missing stat fields)
+def encode_record(record: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        except orjson.JSONEncodeError:
+            pass
+    if tuple(record) == HASHED_RECORD_KEYS and type(record["owner"]) is int:
+        return encode_hashed_record(record)
+    return (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+# collects encoded records in memory and writes each batch with one gather write
+# (os.writev), instead of issuing one small write per record or copying them together
+class RecordWriter:
+    def __init__(self, path: Path, buffer_size: int = WRITE_BUFFER_SIZE) -> None:
+        self._file = open(path, "wb", buffering=0)
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._buffer_size = buffer_size
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = encode_record(record)
+        self._pending.append(line)
+        self._pending_size += len(line)
+        if self._pending_size >= self._buffer_size or len(self._pending) >= WRITEV_MAX_BUFFERS:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+
+        if hasattr(os, "writev"):
+            written = os.writev(self._file.fileno(), self._pending)
+            # a short write leaves a tail, which is finished with plain writes
+            if written < self._pending_size:
+                self._write_all(b"".join(self._pending)[written:])
+        else:
+            self._write_all(b"".join(self._pending))
+
+        self._pending.clear()
+        self._pending_size = 0
+
+    def _write_all(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view):]
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> RecordWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+# forkserver workers fork from a small server process with the modules below already
+# imported, avoiding both fork-after-threads issues and the full start-up cost of spawn
+# platforms without forkserver (Windows) keep their default start method
+def worker_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["hashlib", "mmap", "os", "stat"])
+        return ctx
+    return multiprocessing.get_context()
+
 # VARIANT A — Thread Pool
 def run_threadpool_indexer(
     root: Path,
     output_jsonl: Path,
     hash_algo: str,
-    workers: int
+    workers: int,
+    walk_workers: int = 1
 ) -> None:
-    files = [p for p in root.rglob("*") if p.is_file()]
-
-    with output_jsonl.open("w", encoding="utf-8") as f, \
+    with RecordWriter(output_jsonl) as writer, \
          ThreadPoolExecutor(max_workers=workers) as pool:
 
-        futures = {
-            pool.submit(
-                scan_one_path,
-                p,
-                hash_algo
-            ): p
-            for p in files
-        }
-
-        for future in as_completed(futures):
-            record = future.result()
+        for record in submit_streaming(
+            pool,
+            lambda p: scan_one_path(p, hash_algo),
+            iter_files(root, walk_workers),
+            2 * workers
+        ):
             record["variant"] = "thread_pool"
-            f.write(json.dumps(record) + "\n")
+            writer.write(record)
+
+# error records for every path in a chunk whose worker process died
+def chunk_error_records(job, error: str) -> List[Dict[str, Any]]:
+    paths, hash_algo = job
+    return [
+        {"filename": os.path.basename(p), "path": p, "hash_algo": hash_algo, "error": error}
+        for p in paths
+    ]
+
+# runs chunk jobs on a process pool, at most max_in_flight at a time
+# if a worker dies (e.g. SIGBUS on a mapped file truncated mid-hash), every chunk in
+# flight on that pool fails with it, and there is no telling which one was at fault
+# those chunks are rerun on a fresh pool one at a time; a chunk that breaks the pool
+# on its own is split in half until the failing file is found, so one bad file
+# costs one error record
+def scan_chunks_in_processes(jobs, workers: int, max_in_flight: int) -> Iterator[List[Dict[str, Any]]]:
+    jobs = iter(jobs)
+    suspects: Deque[Any] = deque()
+    while True:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as pool:
+            broken = False
+            while suspects and not broken:
+                job = suspects.popleft()
+                try:
+                    records = pool.submit(scan_chunk_mp, job).result()
+                except BrokenProcessPool as e:
+                    broken = True
+                    paths, hash_algo = job
+                    if len(paths) > 1:
+                        half = len(paths) // 2
+                        suspects.appendleft((paths[half:], hash_algo))
+                        suspects.appendleft((paths[:half], hash_algo))
+                        continue
+                    records = chunk_error_records(job, f"worker process died: {e}")
+                yield records
+
+            in_flight: Dict[Future, Any] = {}
+            while not broken:
+                for job in itertools.islice(jobs, max_in_flight - len(in_flight)):
+                    try:
+                        in_flight[pool.submit(scan_chunk_mp, job)] = job
+                    except BrokenProcessPool:
+                        # not started yet, so retry it on the next pool
+                        jobs = itertools.chain([job], jobs)
+                        broken = True
+                        break
+                if not in_flight:
+                    if broken:
+                        break
+                    return
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        records = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        suspects.append(job)
+                        continue
+                    yield records
+
+            # chunks that finished before the pool broke keep their results
+            for future, job in in_flight.items():
+                try:
+                    records = future.result()
+                except BrokenProcessPool:
+                    suspects.append(job)
+                    continue
+                yield records
 
 # VARIANT B — Multiprocessing
 def run_multiprocess_indexer(
     root: Path,
     output: Path,
     hash_algo: str,
-    workers: int
+    workers: int,
+    walk_workers: int = 1
 ) -> None:
-    files = [p for p in root.rglob("*") if p.is_file()]
+    # DirEntry objects can't be pickled, so workers get plain str paths
+    paths = (e.path for e in iter_files(root, walk_workers))
+    jobs = ((chunk, hash_algo) for chunk in iter_chunks(paths))
 
-    with output.open("w", encoding="utf-8") as f, \
-         ProcessPoolExecutor(max_workers=workers) as pool:
-
-        for record in pool.map(
-            scan_one_path_mp,
-            [(p, hash_algo) for p in files]
-        ):
-            record["variant"] = "multiprocessing"
-            f.write(json.dumps(record) + "\n")
+    with RecordWriter(output) as writer:
+        for records in scan_chunks_in_processes(jobs, workers, 2 * workers):
+            for record in records:
+                record["variant"] = "multiprocessing"
+                writer.write(record)
 
 
 # for the CLI query: reads a previously generated index file and lists all files larger than a given size
 def query_find(index_file: Path, min_mb: int) -> None:
     threshold = min_mb * 1024 * 1024
-    for line in index_file.open():
+    for line in index_file.open(encoding="utf-8"):
         rec = json.loads(line)
         if rec.get("size", 0) > threshold:
             print(rec["path"], rec["size"])
 
 # for the CLI query: searches a previously generated index file and prints the hash of the specified filename if it exists
 def query_checksum(index_file: Path, filename: str) -> None:
-    for line in index_file.open():
+    for line in index_file.open(encoding="utf-8"):
         rec = json.loads(line)
         if rec.get("filename") == filename:
             print(rec.get("hash"))
@@ -125,12 +474,19 @@ if __name__ == "__main__":
     parser.add_argument("--variant", choices=["thread", "process"])
     parser.add_argument("--hash", default="sha256")
     parser.add_argument("--workers", type=int, default=4)
+    # threads used to list directories; 1 walks the tree serially
+    parser.add_argument("--walk-workers", type=int, default=1)
     # greater-than size in MB for 'find' mode
     parser.add_argument("--gt", type=int)
     parser.add_argument("--file")
 
     args = parser.parse_args()
 
+    if args.mode == "index" and not hash_available(args.hash):
+        if args.hash in EXTRA_HASHES:
+            parser.error(f"--hash {args.hash} requires the '{EXTRA_HASHES[args.hash]}' package")
+        parser.error(f"unsupported hash algorithm: {args.hash}")
+
     if args.mode == "index":
 
         base_output = Path("file-indexer-output")
@@ -138,12 +494,12 @@ if __name__ == "__main__":
         if args.variant == "thread":
             output_file = Path("file-indexer-output-thread.jsonl")
             run_threadpool_indexer(
-                args.root, output_file, args.hash, args.workers
+                args.root, output_file, args.hash, args.workers, args.walk_workers
             )
         elif args.variant == "process":
             output_file = Path("file-indexer-output-multiprocess.jsonl")
             run_multiprocess_indexer(
-                args.root, output_file, args.hash, args.workers
+                args.root, output_file, args.hash, args.workers, args.walk_workers
             )
 
     elif args.mode == "find":